@@ -10,11 +10,19 @@ import cv2
 import numpy as np
 from PIL import Image
 import os
+import io
+import json
+import base64
 import uuid
+import time
 import logging
-from werkzeug.utils import secure_filename
 import tempfile
+import threading
+from contextlib import contextmanager
 from scipy.interpolate import splprep, splev
+from shm_arena import SharedMemoryWorkerPool
+from buffer_pool import get_buffer_pool
+from cpu_tuning import configure_opencv_threads
 
 # Configure logging first
 logging.basicConfig(level=logging.INFO)
@@ -54,9 +62,13 @@ if MEDIAPIPE_AVAILABLE:
         MEDIAPIPE_DETECTION_AVAILABLE = False
 
 # Initialize OpenCV cascades
+def load_cascades():
+    """Fresh (face, eye) cascade classifiers"""
+    return (cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'),
+            cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml'))
+
 try:
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+    face_cascade, eye_cascade = load_cascades()
     
     # Test if cascades loaded successfully
     if not face_cascade.empty() and not eye_cascade.empty():
@@ -71,16 +83,40 @@ except Exception as e:
     OPENCV_DETECTION_AVAILABLE = False
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-File-Id', 'X-Style'])
 
 # Configuration
-UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'output'
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_IMAGE_PIXELS = 50 * 1000 * 1000  # Reject decompression bombs above 50MP
+MAX_IMAGE_SIZE = 1024  # Longest side processed by the sketch pipelines
+# Sketches never change once written, so clients may cache them for a year
+SKETCH_CACHE_MAX_AGE = 365 * 24 * 3600
+# Set to nginx's internal location (e.g. /_sketches/) to let nginx send the bytes
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
+# /convert 'response' modes: JSON with a download link, raw PNG, or JSON + PNG
+RESPONSE_MODES = {'json', 'image', 'multipart'}
+# Styles offered by /styles; each one is a stage of SketchGraph
+STYLE_STAGES = ['outline', 'detailed', 'artistic']
+PREVIEW_MAX_SIZE = 512  # Default longest side for /convert/preview thumbnails
+# Cheap face-presence check on a downscaled copy before landmarking;
+# FACE_GATE=0 always runs the full detectors
+FACE_GATE_ENABLED = os.environ.get('FACE_GATE', '1') != '0'
+FACE_MIN_SIZE_RATIO = 0.1  # Smallest face the cascades look for, vs. shortest side
+HAAR_WINDOW_SIZE = 24  # Smallest face a frontal Haar cascade can see, in pixels
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+# Sketch compute processes fed through shared memory; 0 renders in the web worker
+SKETCH_WORKERS = int(os.environ.get('SKETCH_WORKERS', '0'))
+# Seconds a sketch worker may take before it is killed; keep below gunicorn's timeout
+SKETCH_TIMEOUT = float(os.environ.get('SKETCH_TIMEOUT', '60'))
+
+# Share the CPUs between every pipeline that can run at once: one per
+# gunicorn thread in each web worker, or one per sketch worker when those
+# are enabled (the threads then queue on the sketch pool)
+configure_opencv_threads(int(os.environ.get('WEB_CONCURRENCY') or 1) *
+                         (SKETCH_WORKERS or int(os.environ.get('THREADS') or 1)))
 
-# Ensure upload and output directories exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Ensure the output directory exists (uploads are decoded in memory)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
 def smooth_curve(pts, smoothing=2.0, num_pts=100):
@@ -192,6 +228,22 @@ def detect_face_features_mediapipe(image):
         logger.error(f"Error in MediaPipe face detection: {str(e)}")
         return None, None
 
+_thread_cascades = threading.local()
+
+def get_thread_cascades():
+    """
+    This thread's own (face, eye) classifiers: detectMultiScale is not
+    documented as thread-safe, and gunicorn threads detect concurrently
+    """
+    cascades = getattr(_thread_cascades, 'cascades', None)
+    if cascades is None:
+        cascades = _thread_cascades.cascades = load_cascades()
+    return cascades
+
+def min_face_size(gray):
+    """Smallest face, in pixels, the full detectors look for in `gray`"""
+    return max(30, int(min(gray.shape[:2]) * FACE_MIN_SIZE_RATIO))
+
 def detect_face_features_opencv(image):
     """
     Detect facial features using OpenCV cascade classifiers
@@ -203,8 +255,11 @@ def detect_face_features_opencv(image):
     try:
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         
-        # Detect faces
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+        face_cascade, eye_cascade = get_thread_cascades()
+        
+        # Detect faces, ignoring anything too small to be the portrait subject
+        min_face = min_face_size(gray)
+        faces = face_cascade.detectMultiScale(gray, 1.1, 4, minSize=(min_face, min_face))
         
         if len(faces) == 0:
             return None, None
@@ -270,6 +325,121 @@ def detect_face_features_opencv(image):
         logger.error(f"Error in OpenCV face detection: {str(e)}")
         return None, None
 
+# Per-process counters for each face detection tier
+FACE_DETECTION_TIERS = ['gate', 'mediapipe', 'opencv']
+face_detection_stats = {tier: {'calls': 0, 'hits': 0, 'seconds': 0.0} for tier in FACE_DETECTION_TIERS}
+_face_detection_stats_lock = threading.Lock()
+
+def _record_face_tier(tier, hit, seconds):
+    with _face_detection_stats_lock:
+        stats = face_detection_stats[tier]
+        stats['calls'] += 1
+        stats['hits'] += int(bool(hit))
+        stats['seconds'] += seconds
+
+def take_face_detection_stats():
+    """Raw counters recorded since the last call, which resets them"""
+    with _face_detection_stats_lock:
+        taken = {tier: dict(stats) for tier, stats in face_detection_stats.items()}
+        for stats in face_detection_stats.values():
+            stats.update(calls=0, hits=0, seconds=0.0)
+        return taken
+
+def merge_face_detection_stats(counters):
+    """Add counters taken in another process (a sketch worker) to ours"""
+    with _face_detection_stats_lock:
+        for tier, delta in counters.items():
+            stats = face_detection_stats[tier]
+            for key in stats:
+                stats[key] += delta[key]
+
+def get_face_detection_stats():
+    """Snapshot of calls, hit rate and mean time per detection tier"""
+    with _face_detection_stats_lock:
+        snapshot = {}
+        for tier, stats in face_detection_stats.items():
+            calls = stats['calls']
+            snapshot[tier] = {
+                'calls': calls,
+                'hits': stats['hits'],
+                'hit_rate': stats['hits'] / calls if calls else None,
+                'mean_ms': stats['seconds'] * 1000 / calls if calls else None
+            }
+        return snapshot
+
+def face_present_downscaled(gray):
+    """
+    Cheap face-presence gate: Haar cascade on a small copy of the image
+    Returns None when no gate is available, so callers fall through
+    """
+    if not FACE_GATE_ENABLED or not OPENCV_DETECTION_AVAILABLE:
+        return None
+    
+    face_cascade, _ = get_thread_cascades()
+    start = time.perf_counter()
+    height, width = gray.shape[:2]
+    # Shrink only as far as keeps the smallest face the full detectors accept
+    # at least one Haar window wide, so the gate is never the stricter tier
+    scale = HAAR_WINDOW_SIZE / min_face_size(gray)
+    if scale < 1:
+        small = cv2.resize(gray, (int(width * scale), int(height * scale)),
+                           interpolation=cv2.INTER_AREA)
+    else:
+        small = gray
+    # Lenient settings: a false positive only costs one full detection
+    faces = face_cascade.detectMultiScale(small, 1.1, 3)
+    found = len(faces) > 0
+    _record_face_tier('gate', found, time.perf_counter() - start)
+    return found
+
+def _rect_features_to_points(features):
+    """
+    Express OpenCV's (x, y, w, h) feature boxes as corner point lists
+    keyed like the MediaPipe features, so both feed the same drawing code
+    """
+    key_map = {
+        'left_eye': 'left_eye',
+        'right_eye': 'right_eye',
+        'eye': 'left_eye',
+        'nose': 'nose_tip',
+        'mouth': 'mouth_outer'
+    }
+    points = {}
+    for key, (x, y, w, h) in features.items():
+        if key in key_map:
+            points[key_map[key]] = [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
+    return points
+
+def detect_face_features(image, gray=None):
+    """
+    Tiered face detection
+    1. A downscaled Haar check skips landmarking when there is no face
+    2. MediaPipe Face Mesh landmarks, when available
+    3. OpenCV cascades as the fallback
+    Returns (features, tier) with point-list features, or (None, None)
+    """
+    if gray is None:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    
+    if face_present_downscaled(gray) is False:
+        return None, None
+    
+    if MEDIAPIPE_DETECTION_AVAILABLE:
+        start = time.perf_counter()
+        features, _ = detect_face_features_mediapipe(image)
+        _record_face_tier('mediapipe', features, time.perf_counter() - start)
+        if features:
+            return features, 'mediapipe'
+    
+    if OPENCV_DETECTION_AVAILABLE:
+        start = time.perf_counter()
+        features, _ = detect_face_features_opencv(image)
+        _record_face_tier('opencv', features, time.perf_counter() - start)
+        if features:
+            return _rect_features_to_points(features), 'opencv'
+    
+    return None, None
+
 def draw_face_outline_opencv(image, features, face_location):
     """
     Draw clean facial feature outlines using OpenCV detected features
@@ -471,70 +641,80 @@ def draw_face_outline_mediapipe(image, features, face_bbox):
     
     return sketch
 
+def _sketch_from_components(edges, keep, pool):
+    """
+    Label the edge map and draw the components selected by `keep(stats)`
+    as black lines on white. Uses a per-label lookup table instead of one
+    full-frame mask per component; the returned sketch is a fresh array.
+    """
+    labels = pool.take('labels', edges.shape, np.int32)
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(
+        edges, labels=labels, connectivity=8)
+    lut = np.full(num_labels, 255, dtype=np.uint8)
+    lut[1:][keep(stats[1:])] = 0
+    # Plain indexing casts the int32 labels in chunks; np.take would copy them to intp
+    return lut[labels]
+
 def fallback_edge_detection(gray):
     """
     Advanced fallback edge detection with professional quality output
     """
+    pool = get_buffer_pool()
+    shape = gray.shape
+    
     # Step 1: Enhanced preprocessing with multiple techniques
     clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-    enhanced = clahe.apply(gray)
+    enhanced = clahe.apply(gray, dst=pool.take('enhanced', shape))
     
     # Step 2: Multi-scale bilateral filtering for different detail levels
-    smooth_fine = cv2.bilateralFilter(enhanced, 5, 30, 30)
-    smooth_medium = cv2.bilateralFilter(enhanced, 9, 60, 60)
-    smooth_coarse = cv2.bilateralFilter(enhanced, 13, 100, 100)
+    smooth_fine = cv2.bilateralFilter(enhanced, 5, 30, 30, dst=pool.take('smooth_fine', shape))
+    smooth_medium = cv2.bilateralFilter(enhanced, 9, 60, 60, dst=pool.take('smooth_medium', shape))
+    smooth_coarse = cv2.bilateralFilter(enhanced, 13, 100, 100, dst=pool.take('smooth_coarse', shape))
     
     # Step 3: Multi-threshold edge detection
     # Fine details (hair, facial texture)
-    edges_fine = cv2.Canny(smooth_fine, 20, 60)
+    edges_fine = cv2.Canny(smooth_fine, 20, 60, edges=pool.take('edges_fine', shape))
     
     # Medium details (facial features)
-    edges_medium = cv2.Canny(smooth_medium, 40, 120)
+    edges_medium = cv2.Canny(smooth_medium, 40, 120, edges=pool.take('edges_medium', shape))
     
     # Coarse details (face outline, major features)
-    edges_coarse = cv2.Canny(smooth_coarse, 60, 180)
+    edges_coarse = cv2.Canny(smooth_coarse, 60, 180, edges=pool.take('edges_coarse', shape))
     
     # Step 4: Adaptive thresholding for capturing subtle features
     adaptive_fine = cv2.adaptiveThreshold(smooth_fine, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                         cv2.THRESH_BINARY_INV, 9, 3)
-    adaptive_medium = cv2.adaptiveThreshold(smooth_medium, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                           cv2.THRESH_BINARY_INV, 15, 5)
+                                         cv2.THRESH_BINARY_INV, 9, 3,
+                                         dst=pool.take('adaptive', shape))
     
-    # Step 5: Combine all edge maps with weights
-    edges_combined = cv2.addWeighted(edges_fine, 0.3, edges_medium, 0.4, 0)
-    edges_combined = cv2.addWeighted(edges_combined, 1.0, edges_coarse, 0.3, 0)
+    # Step 5: Combine all edge maps with weights (in place, into the fine map)
+    edges_combined = cv2.addWeighted(edges_fine, 0.3, edges_medium, 0.4, 0, dst=edges_fine)
+    edges_combined = cv2.addWeighted(edges_combined, 1.0, edges_coarse, 0.3, 0, dst=edges_combined)
     
-    # Add adaptive threshold edges (thinned for better integration)
-    kernel_thin = np.ones((1,1), np.uint8)
-    adaptive_thin = cv2.erode(adaptive_fine, kernel_thin, iterations=1)
-    edges_combined = cv2.bitwise_or(edges_combined, adaptive_thin)
+    # Add adaptive threshold edges (a 1x1 erosion is the identity, so OR directly)
+    edges_combined = cv2.bitwise_or(edges_combined, adaptive_fine, dst=edges_combined)
     
     # Step 6: Advanced morphological operations
     # Close gaps in contours
     kernel_close = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3,3))
-    edges_combined = cv2.morphologyEx(edges_combined, cv2.MORPH_CLOSE, kernel_close)
+    closed = cv2.morphologyEx(edges_combined, cv2.MORPH_CLOSE, kernel_close,
+                              dst=pool.take('edges_medium', shape))
     
     # Strengthen main lines
     kernel_dilate = np.ones((2,2), np.uint8)
-    edges_combined = cv2.dilate(edges_combined, kernel_dilate, iterations=1)
+    edges_combined = cv2.dilate(closed, kernel_dilate, dst=edges_combined, iterations=1)
     
     # Step 7: Intelligent noise removal with size and shape filtering
-    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(edges_combined, connectivity=8)
-    clean_edges = np.zeros_like(edges_combined)
-    
-    for i in range(1, num_labels):
-        area = stats[i, cv2.CC_STAT_AREA]
-        width = stats[i, cv2.CC_STAT_WIDTH]
-        height = stats[i, cv2.CC_STAT_HEIGHT]
-        aspect_ratio = max(width, height) / max(min(width, height), 1)
-        
+    def keep(stats):
+        area = stats[:, cv2.CC_STAT_AREA]
+        width = stats[:, cv2.CC_STAT_WIDTH]
+        height = stats[:, cv2.CC_STAT_HEIGHT]
+        aspect_ratio = np.maximum(width, height) / np.maximum(np.minimum(width, height), 1)
         # Keep components based on size and shape
-        if area >= 15 and (area >= 50 or aspect_ratio > 2):
-            clean_edges[labels == i] = 255
+        return (area >= 15) & ((area >= 50) | (aspect_ratio > 2))
     
     # Step 8: Final enhancement - add artistic touches
-    sketch = np.ones_like(gray) * 255
-    sketch[clean_edges > 0] = 0
+    sketch = _sketch_from_components(edges_combined, keep, pool)
+    pool.trim()
     
     # Add subtle texture for artistic effect
     height, width = sketch.shape
@@ -549,164 +729,351 @@ def fallback_edge_detection(gray):
     
     return sketch
 
-def create_outline_sketch(image, style='outline'):
+# Registry of named sketch stages; see SketchGraph
+SKETCH_STAGES = {}
+
+def sketch_stage(name):
+    """Register a pipeline stage. Stages pull their inputs with graph.get()"""
+    def register(func):
+        SKETCH_STAGES[name] = func
+        return func
+    return register
+
+class SketchGraph:
+    """
+    Memoised DAG of sketch stages for a single image
+    Every style is a stage that asks the graph for the stages it builds on
+    (grayscale, face features, ...), so rendering several styles from one
+    graph computes each shared stage only once. Stage outputs are always
+    fresh arrays; pooled buffers are only scratch space inside a stage.
+    """
+    
+    def __init__(self, image):
+        self.image = image
+        self.pool = get_buffer_pool()
+        self.timings = {}       # stage -> seconds spent in the stage itself
+        self.dependencies = {}  # stage -> stages it requested
+        self._results = {}
+        self._stack = []
+    
+    def get(self, name):
+        """Return a stage's output, computing it (and its inputs) on first use"""
+        if self._stack:
+            self.dependencies[self._stack[-1][0]].add(name)
+        if name in self._results:
+            return self._results[name]
+        
+        self.dependencies[name] = set()
+        self._stack.append([name, 0.0])
+        start = time.perf_counter()
+        try:
+            result = SKETCH_STAGES[name](self)
+        finally:
+            elapsed = time.perf_counter() - start
+            _, nested = self._stack.pop()
+        # Report exclusive time; the parent stage should not count ours
+        self.timings[name] = elapsed - nested
+        if self._stack:
+            self._stack[-1][1] += elapsed
+        self._results[name] = result
+        return result
+    
+    def stages_for(self, name):
+        """All stages the given stage depended on, itself included"""
+        seen = set()
+        pending = [name]
+        while pending:
+            stage = pending.pop()
+            if stage not in seen:
+                seen.add(stage)
+                pending.extend(self.dependencies.get(stage, ()))
+        return seen
+    
+    def cost_of(self, name):
+        """Seconds the stage would take on its own, without shared results"""
+        return sum(self.timings.get(stage, 0.0) for stage in self.stages_for(name))
+
+@sketch_stage('gray')
+def _stage_gray(graph):
+    return cv2.cvtColor(graph.image, cv2.COLOR_BGR2GRAY)
+
+@sketch_stage('face_features')
+def _stage_face_features(graph):
+    features, tier = detect_face_features(graph.image, graph.get('gray'))
+    if features:
+        logger.info(f"Face features found by the {tier} detector")
+    return features
+
+@sketch_stage('face_edges')
+def _stage_face_edges(graph):
+    # A more detailed edge map using Canny detector for the face region
+    return cv2.Canny(graph.get('gray'), 60, 120)
+
+@sketch_stage('dodge')
+def _stage_dodge(graph):
+    gray = graph.get('gray')
+    
+    # Step 1: Create a base sketch using the Color Dodge blending technique.
+    # This professional method creates a natural, hand-drawn look from a photo.
+    inverted_gray = 255 - gray
+    
+    # A larger blur kernel creates thicker, more defined lines suitable for coloring.
+    blurred = cv2.GaussianBlur(inverted_gray, (51, 51), 0)
+    dodged_sketch = cv2.divide(gray, 255 - blurred, scale=256)
+    
+    # Step 2: Convert to a clean black-and-white image.
+    # A threshold cleans up noise and ensures solid lines for coloring.
+    _, sketch = cv2.threshold(dodged_sketch, 190, 255, cv2.THRESH_BINARY)
+    return sketch
+
+# =====================================================================================
+# === START: MODIFIED BLOCK FOR 'Contur Facial Detaliat' =======================================
+# =====================================================================================
+@sketch_stage('outline')
+def _stage_outline(graph):
+    logger.info("Generating 'Contur Facial Detaliat' using the new advanced sketching algorithm.")
+    sketch = graph.get('dodge')
+    
+    # Step 3: Intelligently enhance facial features (MediaPipe, or OpenCV as fallback) for sharpness.
+    features = graph.get('face_features')
+    if features:
+        logger.info("Face detected. Refining feature details...")
+        face_edges = graph.get('face_edges')
+        gray = graph.get('gray')
+        
+        # Create a mask covering only the core facial features.
+        feature_mask = np.zeros_like(gray)
+        keys_to_draw = ['left_eye', 'right_eye', 'left_eyebrow', 'right_eyebrow', 'mouth_outer', 'nose_tip']
+        
+        for key in keys_to_draw:
+            if key in features:
+                points = np.array(features[key], np.int32)
+                # A convex hull creates a solid shape over the feature points.
+                if len(points) > 2:
+                    hull = cv2.convexHull(points)
+                    cv2.drawContours(feature_mask, [hull], -1, 255, -1) # -1 fills the shape
+        
+        # Dilate the mask to create a soft "glow" or blending area around the features.
+        mask_dilated = cv2.dilate(feature_mask, np.ones((25, 25), np.uint8), iterations=1)
+        
+        # The final composition: where the mask is white, use the sharp Canny edges;
+        # everywhere else, use the beautiful and soft dodged sketch.
+        sketch = np.where(mask_dilated == 255, (255 - face_edges), sketch)
+
+    else:
+        logger.warning("No face detected. Returning the base sketch without enhancement.")
+
+    logger.info("Advanced outline completed.")
+    return sketch
+# =====================================================================================
+# === END: MODIFIED BLOCK =============================================================
+# =====================================================================================
+
+@sketch_stage('detailed')
+def _stage_detailed(graph):
+    gray = graph.get('gray')
+    
+    # Enhanced detailed coloring book style for facial features
+    # Intermediates live in this thread's buffer pool (see buffer_pool.py)
+    pool = graph.pool
+    shape = gray.shape
+    
+    # Step 1: Preprocessing for better edge detection
+    # Apply CLAHE for better contrast in facial features
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    enhanced = clahe.apply(gray, dst=pool.take('enhanced', shape))
+    
+    # Step 2: Multi-scale edge detection
+    # Smooth with different parameters to capture different details
+    smooth_fine = cv2.bilateralFilter(enhanced, 5, 20, 20, dst=pool.take('smooth_fine', shape))
+    smooth_medium = cv2.bilateralFilter(enhanced, 9, 40, 40, dst=pool.take('smooth_medium', shape))
+    smooth_coarse = cv2.bilateralFilter(enhanced, 13, 60, 60, dst=pool.take('smooth_coarse', shape))
+    
+    # Fine details (eyes, mouth details)
+    edges_fine = cv2.Canny(smooth_fine, 30, 70, edges=pool.take('edges_fine', shape))
+    
+    # Medium details (nose, face contours)
+    edges_medium = cv2.Canny(smooth_medium, 40, 100, edges=pool.take('edges_medium', shape))
+    
+    # Coarse details (hair, face outline)
+    edges_coarse = cv2.Canny(smooth_coarse, 50, 150, edges=pool.take('edges_coarse', shape))
+    
+    # Step 3: Use adaptive threshold for additional detail capture
+    adaptive = cv2.adaptiveThreshold(smooth_fine, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                   cv2.THRESH_BINARY_INV, 11, 2,
+                                   dst=pool.take('adaptive', shape))
+    
+    # Step 4: Combine all edge maps (in place, into the fine map)
+    edges = cv2.bitwise_or(edges_fine, edges_medium, dst=edges_fine)
+    edges = cv2.bitwise_or(edges, edges_coarse, dst=edges)
+    
+    # Add adaptive threshold edges for extra detail
+    # (a 1x1 erosion is the identity, so OR them in directly)
+    edges = cv2.bitwise_or(edges, adaptive, dst=edges)
+    
+    # Step 5: Clean up and connect lines
+    # Use morphological operations to clean up the sketch
+    kernel_cleanup = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2,2))
+    closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel_cleanup,
+                              dst=pool.take('edges_medium', shape))
+    
+    # Dilate slightly for visibility
+    kernel_dilate = np.ones((2,2), np.uint8)
+    edges = cv2.dilate(closed, kernel_dilate, dst=edges, iterations=1)
+    
+    # Step 6: Create the final sketch, black lines on white,
+    # dropping very small components to reduce noise
+    min_size = 10  # Minimum component size in pixels
+    sketch = _sketch_from_components(
+        edges, lambda stats: stats[:, cv2.CC_STAT_AREA] >= min_size, pool)
+    return sketch
+
+@sketch_stage('artistic')
+def _stage_artistic(graph):
+    gray = graph.get('gray')
+    
+    # Artistic coloring book style with varied line weights
+    smooth = cv2.bilateralFilter(gray, 20, 100, 100)
+    
+    # Create artistic edges with different intensities
+    edges1 = cv2.Canny(smooth, 40, 120)
+    edges2 = cv2.Canny(smooth, 100, 250)
+    
+    # Combine with different weights
+    edges = cv2.addWeighted(edges1, 0.7, edges2, 0.3, 0)
+    
+    # Artistic thick lines
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3,3))
+    edges = cv2.dilate(edges, kernel, iterations=1)
+    
+    # White background with black lines
+    sketch = np.ones_like(gray) * 255
+    sketch[edges > 0] = 0
+    return sketch
+
+@sketch_stage('default')
+def _stage_default(graph):
+    gray = graph.get('gray')
+    
+    # Default to outline
+    smooth = cv2.bilateralFilter(gray, 15, 80, 80)
+    edges = cv2.Canny(smooth, 50, 150)
+    kernel = np.ones((2,2), np.uint8)
+    edges = cv2.dilate(edges, kernel, iterations=1)
+    sketch = np.ones_like(gray) * 255
+    sketch[edges > 0] = 0
+    return sketch
+
+def resolve_style(style):
+    """The stage that renders `style`; unknown styles fall back to a plain outline"""
+    return style if style in STYLE_STAGES else 'default'
+
+def create_outline_sketch(image, style='outline', graph=None):
     """
     Convert image to coloring book style sketch
     
     Args:
         image: OpenCV image (BGR format)
         style: 'outline', 'detailed', 'artistic'
+        graph: optional SketchGraph for `image`, to share stages across styles
     
     Returns:
         OpenCV image (grayscale sketch)
     """
     try:
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Apply different processing based on style
-        
-        # =====================================================================================
-        # === START: MODIFIED BLOCK FOR 'Contur Facial Detaliat' =======================================
-        # =====================================================================================
-        if style == 'outline':
-            logger.info("Generating 'Contur Facial Detaliat' using the new advanced sketching algorithm.")
-            
-            # Step 1: Create a base sketch using the Color Dodge blending technique.
-            # This professional method creates a natural, hand-drawn look from a photo.
-            inverted_gray = 255 - gray
-            
-            # A larger blur kernel creates thicker, more defined lines suitable for coloring.
-            blurred = cv2.GaussianBlur(inverted_gray, (51, 51), 0)
-            dodged_sketch = cv2.divide(gray, 255 - blurred, scale=256)
-            
-            # Step 2: Convert to a clean black-and-white image.
-            # A threshold cleans up noise and ensures solid lines for coloring.
-            _, sketch = cv2.threshold(dodged_sketch, 190, 255, cv2.THRESH_BINARY)
-
-            # Step 3: Intelligently enhance facial features using MediaPipe for sharpness.
-            features, _ = detect_face_features_mediapipe(image)
-            if features:
-                logger.info("MediaPipe detected a face. Refining feature details...")
-                # Create a more detailed edge map using Canny detector for the face region.
-                face_edges = cv2.Canny(gray, 60, 120)
-                
-                # Create a mask covering only the core facial features.
-                feature_mask = np.zeros_like(gray)
-                keys_to_draw = ['left_eye', 'right_eye', 'left_eyebrow', 'right_eyebrow', 'mouth_outer', 'nose_tip']
-                
-                for key in keys_to_draw:
-                    if key in features:
-                        points = np.array(features[key], np.int32)
-                        # A convex hull creates a solid shape over the feature points.
-                        if len(points) > 2:
-                            hull = cv2.convexHull(points)
-                            cv2.drawContours(feature_mask, [hull], -1, 255, -1) # -1 fills the shape
-                
-                # Dilate the mask to create a soft "glow" or blending area around the features.
-                mask_dilated = cv2.dilate(feature_mask, np.ones((25, 25), np.uint8), iterations=1)
-                
-                # The final composition: where the mask is white, use the sharp Canny edges;
-                # everywhere else, use the beautiful and soft dodged sketch.
-                sketch = np.where(mask_dilated == 255, (255 - face_edges), sketch)
-
-            else:
-                logger.warning("MediaPipe did not detect a face. Returning the base sketch without enhancement.")
-
-            logger.info("Advanced outline completed.")
-        # =====================================================================================
-        # === END: MODIFIED BLOCK =============================================================
-        # =====================================================================================
-
-        elif style == 'detailed':
-            # Enhanced detailed coloring book style for facial features
-            # Step 1: Preprocessing for better edge detection
-            # Apply CLAHE for better contrast in facial features
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-            enhanced = clahe.apply(gray)
-            
-            # Step 2: Multi-scale edge detection
-            # Smooth with different parameters to capture different details
-            smooth_fine = cv2.bilateralFilter(enhanced, 5, 20, 20)
-            smooth_medium = cv2.bilateralFilter(enhanced, 9, 40, 40)
-            smooth_coarse = cv2.bilateralFilter(enhanced, 13, 60, 60)
-            
-            # Fine details (eyes, mouth details)
-            edges_fine = cv2.Canny(smooth_fine, 30, 70)
-            
-            # Medium details (nose, face contours)
-            edges_medium = cv2.Canny(smooth_medium, 40, 100)
-            
-            # Coarse details (hair, face outline)
-            edges_coarse = cv2.Canny(smooth_coarse, 50, 150)
-            
-            # Step 3: Use adaptive threshold for additional detail capture
-            adaptive = cv2.adaptiveThreshold(smooth_fine, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                           cv2.THRESH_BINARY_INV, 11, 2)
-            
-            # Step 4: Combine all edge maps
-            edges = cv2.bitwise_or(edges_fine, edges_medium)
-            edges = cv2.bitwise_or(edges, edges_coarse)
-            
-            # Add adaptive threshold edges for extra detail
-            kernel_small = np.ones((1,1), np.uint8)
-            adaptive_thin = cv2.erode(adaptive, kernel_small, iterations=1)
-            edges = cv2.bitwise_or(edges, adaptive_thin)
-            
-            # Step 5: Clean up and connect lines
-            # Use morphological operations to clean up the sketch
-            kernel_cleanup = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2,2))
-            edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel_cleanup)
-            
-            # Dilate slightly for visibility
-            kernel_dilate = np.ones((2,2), np.uint8)
-            edges = cv2.dilate(edges, kernel_dilate, iterations=1)
-            
-            # Step 6: Create the final sketch
-            sketch = np.ones_like(gray) * 255  # White background
-            sketch[edges > 0] = 0  # Black lines
-            
-            # Optional: Reduce noise by removing very small components
-            num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(edges, connectivity=8)
-            min_size = 10  # Minimum component size in pixels
-            for i in range(1, num_labels):
-                if stats[i, cv2.CC_STAT_AREA] < min_size:
-                    sketch[labels == i] = 255
-            
-        elif style == 'artistic':
-            # Artistic coloring book style with varied line weights
-            smooth = cv2.bilateralFilter(gray, 20, 100, 100)
-            
-            # Create artistic edges with different intensities
-            edges1 = cv2.Canny(smooth, 40, 120)
-            edges2 = cv2.Canny(smooth, 100, 250)
-            
-            # Combine with different weights
-            edges = cv2.addWeighted(edges1, 0.7, edges2, 0.3, 0)
-            
-            # Artistic thick lines
-            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3,3))
-            edges = cv2.dilate(edges, kernel, iterations=1)
-            
-            # White background with black lines
-            sketch = np.ones_like(gray) * 255
-            sketch[edges > 0] = 0
-            
-        else:
-            # Default to outline
-            smooth = cv2.bilateralFilter(gray, 15, 80, 80)
-            edges = cv2.Canny(smooth, 50, 150)
-            kernel = np.ones((2,2), np.uint8)
-            edges = cv2.dilate(edges, kernel, iterations=1)
-            sketch = np.ones_like(gray) * 255
-            sketch[edges > 0] = 0
-        
-        return sketch
+        owns_graph = graph is None
+        if owns_graph:
+            graph = SketchGraph(image)
+        try:
+            return graph.get(resolve_style(style))
+        finally:
+            # A render we started is over; don't keep its scratch frames resident
+            if owns_graph:
+                graph.pool.trim()
         
     except Exception as e:
         logger.error(f"Error in create_outline_sketch: {str(e)}")
         raise
 
+def _render_sketch_into(image, out, style):
+    """Sketch worker entry point: render straight into the shared output buffer"""
+    out[...] = create_outline_sketch(image, style)
+
+def _in_sketch_worker(image, out, target, *args):
+    """
+    Run `target` in a sketch worker and hand back the face detection
+    counters it recorded, which would otherwise stay in the worker process
+    """
+    return target(image, out, *args), take_face_detection_stats()
+
+_sketch_pool = None
+_sketch_pool_lock = threading.Lock()
+
+def get_sketch_pool():
+    """Lazily start the shared-memory sketch pool for this web worker"""
+    global _sketch_pool
+    if SKETCH_WORKERS <= 0:
+        return None
+    with _sketch_pool_lock:
+        if _sketch_pool is None:
+            _sketch_pool = SharedMemoryWorkerPool(_render_sketch_into, SKETCH_WORKERS,
+                                                  timeout=SKETCH_TIMEOUT)
+            logger.info(f"Started {SKETCH_WORKERS} shared-memory sketch workers")
+        return _sketch_pool
+
+def _render_previews_into(image, out, styles):
+    """
+    Sketch worker entry point for /convert/preview: render every style from
+    one SketchGraph into `out[i]` and return the graph's timings in ms
+    """
+    graph = SketchGraph(image)
+    try:
+        for i, style in enumerate(styles):
+            out[i] = create_outline_sketch(image, style, graph=graph)
+    finally:
+        graph.pool.trim()
+    return {
+        'stages_ms': {name: seconds * 1000 for name, seconds in graph.timings.items()},
+        'individual_ms': {style: graph.cost_of(style) * 1000 for style in styles}
+    }
+
+@contextmanager
+def _offload(pool, target, image, shape, *args):
+    """Run a sketch worker entry point, yielding its (uint8 output, result)"""
+    with pool.call(_in_sketch_worker, image, shape, np.uint8, target, *args) as (out, returned):
+        result, face_stats = returned
+        merge_face_detection_stats(face_stats)
+        yield out, result
+
+@contextmanager
+def render_sketch(image, style):
+    """
+    Produce the sketch for an image, in a sketch worker when configured
+    The yielded array may live in shared memory and is only valid inside
+    the `with` block.
+    """
+    pool = get_sketch_pool()
+    if pool is None:
+        yield create_outline_sketch(image, style)
+        return
+    with _offload(pool, _render_sketch_into, image, image.shape[:2], style) as (sketch, _):
+        yield sketch
+
+@contextmanager
+def render_previews(image, styles):
+    """
+    Every style stacked as one (len(styles), h, w) array plus stage timings,
+    rendered like render_sketch(): in a sketch worker when configured
+    """
+    shape = (len(styles),) + image.shape[:2]
+    pool = get_sketch_pool()
+    if pool is None:
+        out = np.empty(shape, np.uint8)
+        yield out, _render_previews_into(image, out, styles)
+        return
+    with _offload(pool, _render_previews_into, image, shape, styles) as result:
+        yield result
+
 def resize_image(image, max_size=1024):
     """Resize image if it's too large while maintaining aspect ratio"""
     height, width = image.shape[:2]
@@ -723,97 +1090,278 @@ def resize_image(image, max_size=1024):
     
     return cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
 
+# JPEG can be decoded straight to 1/2, 1/4 or 1/8 scale in the DCT domain
+REDUCED_JPEG_DECODE = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+def probe_image(source):
+    """
+    Read format and dimensions from the image header without decoding pixels
+    Raises ValueError for unreadable files and decompression bombs
+    """
+    try:
+        with Image.open(source) as img:
+            image_format = img.format
+            width, height = img.size
+    except Image.DecompressionBombError:
+        raise ValueError('Image dimensions too large')
+    except Exception:
+        raise ValueError('Invalid image file')
+    
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ValueError('Image dimensions too large')
+    
+    return image_format, width, height
+
+def decode_flag_for(image_format, width, height, max_size):
+    """Pick the smallest JPEG decode scale that still covers max_size"""
+    if image_format == 'JPEG':
+        for factor, flag in REDUCED_JPEG_DECODE:
+            if max(width, height) // factor >= max_size:
+                return flag
+    return cv2.IMREAD_COLOR
+
+def load_image(data, max_size=MAX_IMAGE_SIZE):
+    """
+    Probe, decode at reduced scale when possible and resize to max_size
+    Takes the encoded bytes; returns None if OpenCV cannot decode them
+    """
+    image_format, width, height = probe_image(io.BytesIO(data))
+    image = cv2.imdecode(np.frombuffer(data, np.uint8),
+                         decode_flag_for(image_format, width, height, max_size))
+    if image is None:
+        return None
+    return resize_image(image, max_size=max_size)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'version': '1.0.0'})
 
+def read_uploaded_image(max_size):
+    """
+    Validate the 'image' upload and decode it
+    Returns (image, None) on success or (None, error message)
+    """
+    # Check if file was uploaded
+    if 'image' not in request.files:
+        return None, 'No image file provided'
+    
+    file = request.files['image']
+    
+    if file.filename == '':
+        return None, 'No file selected'
+    
+    if not allowed_file(file.filename):
+        return None, 'File type not allowed. Use JPG, PNG, or WEBP'
+    
+    # Check file size
+    file.seek(0, os.SEEK_END)
+    file_size = file.tell()
+    file.seek(0)
+    
+    if file_size > MAX_FILE_SIZE:
+        return None, 'File too large. Maximum size is 10MB'
+    
+    # Probe the header, then decode from memory at the smallest scale that fits
+    try:
+        image = load_image(file.read(), max_size=max_size)
+    except ValueError as e:
+        return None, str(e)
+    if image is None:
+        return None, 'Invalid image file'
+    
+    return image, None
+
 @app.route('/convert', methods=['POST'])
 def convert_photo():
     """Main endpoint to convert photo to coloring sketch"""
     try:
-        # Check if file was uploaded
-        if 'image' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
-        
-        file = request.files['image']
         style = request.form.get('style', 'outline')
         
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
-        
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'File type not allowed. Use JPG, PNG, or WEBP'}), 400
+        # 'json' needs the file on disk for /download; the inline modes only
+        # keep it when explicitly asked to
+        response_mode = request.form.get('response', 'json')
+        if response_mode not in RESPONSE_MODES:
+            return jsonify({'error': f"Unknown response mode. Use one of: {', '.join(sorted(RESPONSE_MODES))}"}), 400
+        persist = response_mode == 'json' or \
+                  request.form.get('persist', '').lower() in ('1', 'true', 'yes')
         
-        # Check file size
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
+        file_id = str(uuid.uuid4())
+        logger.info(f"Processing image {file_id} with style: {style}")
         
-        if file_size > MAX_FILE_SIZE:
-            return jsonify({'error': 'File too large. Maximum size is 10MB'}), 400
+        image, error = read_uploaded_image(MAX_IMAGE_SIZE)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Generate unique filename
-        file_id = str(uuid.uuid4())
-        filename = secure_filename(file.filename)
-        file_extension = filename.rsplit('.', 1)[1].lower()
+        # Convert to sketch and encode it once for every response mode
+        with render_sketch(image, style) as sketch:
+            success, encoded = cv2.imencode('.png', sketch)
+        if not success:
+            raise RuntimeError('PNG encoding failed')
+        png_bytes = encoded.tobytes()
         
-        # Save uploaded file
-        upload_path = os.path.join(UPLOAD_FOLDER, f"{file_id}.{file_extension}")
-        file.save(upload_path)
+        result = {
+            'success': True,
+            'style': style
+        }
         
-        logger.info(f"Processing image: {upload_path} with style: {style}")
+        if persist:
+            output_path = os.path.join(OUTPUT_FOLDER, f"{file_id}_sketch.png")
+            with open(output_path, 'wb') as output_file:
+                output_file.write(png_bytes)
+            result['file_id'] = file_id
+            result['download_url'] = f'/download/{file_id}'
+            logger.info(f"Successfully processed image. Output: {output_path}")
+        else:
+            logger.info(f"Successfully processed image {file_id} (not persisted)")
         
-        # Load and process image
-        image = cv2.imread(upload_path)
-        if image is None:
-            os.remove(upload_path)
-            return jsonify({'error': 'Invalid image file'}), 400
+        if response_mode == 'image':
+            response = app.response_class(png_bytes, mimetype='image/png')
+            # Report the stage actually rendered, never the raw form value
+            response.headers['X-Style'] = resolve_style(style)
+            if persist:
+                response.headers['X-File-Id'] = file_id
+            return response
         
-        # Resize if too large
-        image = resize_image(image, max_size=1024)
+        if response_mode == 'multipart':
+            return multipart_response(result, png_bytes)
         
-        # Convert to sketch
-        sketch = create_outline_sketch(image, style)
+        return jsonify(result)
         
-        # Save result
-        output_path = os.path.join(OUTPUT_FOLDER, f"{file_id}_sketch.png")
-        cv2.imwrite(output_path, sketch)
+    except Exception as e:
+        logger.error(f"Error processing image: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/convert/preview', methods=['POST'])
+def preview_styles():
+    """
+    Render every style from one upload for the style picker, in a sketch
+    worker when SKETCH_WORKERS is set. Only the decode and the grayscale
+    stage are shared (face detection is used by 'outline' alone), so this
+    saves requests rather than compute; the response reports per-stage
+    timings and what separate /convert calls would have cost.
+    """
+    try:
+        try:
+            max_size = min(int(request.form.get('max_size', PREVIEW_MAX_SIZE)), MAX_IMAGE_SIZE)
+        except ValueError:
+            return jsonify({'error': 'max_size must be an integer'}), 400
+        if max_size <= 0:
+            return jsonify({'error': 'max_size must be positive'}), 400
         
-        # Clean up uploaded file
-        os.remove(upload_path)
+        image, error = read_uploaded_image(max_size)
+        if error:
+            return jsonify({'error': error}), 400
         
-        logger.info(f"Successfully processed image. Output: {output_path}")
+        previews = {}
+        with render_previews(image, STYLE_STAGES) as (sketches, timings):
+            for style, sketch in zip(STYLE_STAGES, sketches):
+                success, encoded = cv2.imencode('.png', sketch)
+                if not success:
+                    raise RuntimeError('PNG encoding failed')
+                previews[style] = 'data:image/png;base64,' + base64.b64encode(encoded).decode('ascii')
         
         return jsonify({
             'success': True,
-            'file_id': file_id,
-            'download_url': f'/download/{file_id}',
-            'style': style
+            'styles': previews,
+            'timings': {
+                'stages_ms': timings['stages_ms'],
+                'individual_ms': timings['individual_ms'],
+                'individual_total_ms': sum(timings['individual_ms'].values()),
+                'combined_ms': sum(timings['stages_ms'].values())
+            }
         })
         
     except Exception as e:
-        logger.error(f"Error processing image: {str(e)}")
+        logger.error(f"Error rendering previews: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def multipart_response(metadata, png_bytes):
+    """
+    JSON metadata plus the PNG in one multipart/form-data body, which
+    browsers can unpack with `await response.formData()`
+    """
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        b'Content-Disposition: form-data; name="metadata"\r\n',
+        b'Content-Type: application/json\r\n\r\n',
+        json.dumps(metadata).encode(), b'\r\n',
+        f'--{boundary}\r\n'.encode(),
+        b'Content-Disposition: form-data; name="image"; filename="sketch.png"\r\n',
+        b'Content-Type: image/png\r\n\r\n',
+        png_bytes, b'\r\n',
+        f'--{boundary}--\r\n'.encode(),
+    ])
+    return app.response_class(body, content_type=f'multipart/form-data; boundary={boundary}')
+
+def is_valid_file_id(file_id):
+    """File ids are the UUIDs issued by /convert"""
+    try:
+        return str(uuid.UUID(file_id)) == file_id
+    except ValueError:
+        return False
+
 @app.route('/download/<file_id>', methods=['GET'])
 def download_sketch(file_id):
     """Download the generated sketch"""
     try:
-        output_path = os.path.join(OUTPUT_FOLDER, f"{file_id}_sketch.png")
+        if not is_valid_file_id(file_id):
+            return jsonify({'error': 'File not found'}), 404
+        
+        # A file id always names the same bytes, so it doubles as a strong ETag
+        # and a request naming it needs no disk access at all. `*` only matches
+        # a file that exists, so it takes the normal path below
+        etag = file_id
+        if_none_match = request.if_none_match
+        if not if_none_match.star_tag and if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.cache_control.public = True
+            response.cache_control.max_age = SKETCH_CACHE_MAX_AGE
+            response.cache_control.immutable = True
+            return response
+        
+        filename = f"{file_id}_sketch.png"
+        output_path = os.path.join(OUTPUT_FOLDER, filename)
         
         if not os.path.exists(output_path):
             return jsonify({'error': 'File not found'}), 404
         
-        return send_file(output_path, 
-                        as_attachment=True, 
-                        download_name=f'coloring_sketch_{file_id}.png',
-                        mimetype='image/png')
+        download_name = f'coloring_sketch_{file_id}.png'
+        if X_ACCEL_REDIRECT_PREFIX:
+            # nginx streams the file itself; this worker is free immediately.
+            # nginx drops our ETag on the internal redirect and sends its own
+            # mtime/size one, so clients revalidate against nginx from then on
+            response = app.response_class(mimetype='image/png')
+            response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX + filename
+            response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+            response.set_etag(etag)
+            response.cache_control.public = True
+            response.cache_control.max_age = SKETCH_CACHE_MAX_AGE
+        else:
+            response = send_file(output_path, 
+                                as_attachment=True, 
+                                download_name=download_name,
+                                mimetype='image/png',
+                                etag=etag,
+                                max_age=SKETCH_CACHE_MAX_AGE)
+        response.cache_control.immutable = True
+        return response
     
     except Exception as e:
         logger.error(f"Error downloading file: {str(e)}")
         return jsonify({'error': 'Error downloading file'}), 500
 
+@app.route('/stats/face-detection', methods=['GET'])
+def face_detection_stats_endpoint():
+    """Per-tier face detection counters for this web worker and its sketch workers"""
+    return jsonify({'pid': os.getpid(), 'tiers': get_face_detection_stats()})
+
 @app.route('/styles', methods=['GET'])
 def get_styles():
     """Get available conversion styles"""
@@ -842,7 +1390,7 @@ def cleanup_old_files():
     import time
     current_time = time.time()
     
-    for folder in [UPLOAD_FOLDER, OUTPUT_FOLDER]:
+    for folder in [OUTPUT_FOLDER]:
         for filename in os.listdir(folder):
             file_path = os.path.join(folder, filename)
             if os.path.isfile(file_path):
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Reusable per-thread scratch buffers for the sketch pipelines
+Full-frame intermediates are written into pooled arrays via OpenCV's
+dst= outputs instead of being allocated afresh for every step. Buffers are
+shared by all stages of a render and freed when it ends (see trim()), so
+an idle gunicorn thread holds no frames.
+"""
+
+import os
+import threading
+
+import numpy as np
+
+# Set SKETCH_BUFFER_POOL=0 to allocate every intermediate per request
+ENABLED = os.environ.get('SKETCH_BUFFER_POOL', '1') != '0'
+# Bytes a thread's pool may keep between renders. Keeping frames resident
+# measured no faster than reallocating them, so by default none are kept
+IDLE_BYTES = int(float(os.environ.get('SKETCH_BUFFER_POOL_IDLE_MB', '0')) * 2**20)
+
+
+class BufferPool:
+    """
+    Named scratch buffers sized to the largest frame seen so far
+    A request asks for `take('smooth_fine', shape)` and gets a contiguous
+    view of the right shape and dtype over that name's backing storage, so
+    frames of different sizes share the same memory. Views handed out under
+    one name are overwritten by the next `take` of that name; anything that
+    leaves the pipeline must be a fresh array.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._storage = {}
+
+    def take(self, name, shape, dtype=np.uint8):
+        dtype = np.dtype(dtype)
+        if not self.enabled:
+            return np.empty(shape, dtype=dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        storage = self._storage.get(name)
+        if storage is None or storage.nbytes < nbytes:
+            storage = np.empty(nbytes, dtype=np.uint8)
+            self._storage[name] = storage
+        return storage[:nbytes].view(dtype).reshape(shape)
+
+    @property
+    def nbytes(self):
+        """Total bytes currently held by the pool"""
+        return sum(storage.nbytes for storage in self._storage.values())
+
+    def trim(self, max_bytes=None):
+        """Free the largest buffers until at most `max_bytes` (IDLE_BYTES) stay held"""
+        if max_bytes is None:
+            max_bytes = IDLE_BYTES
+        held = self.nbytes
+        for name in sorted(self._storage, key=lambda n: self._storage[n].nbytes, reverse=True):
+            if held <= max_bytes:
+                break
+            held -= self._storage.pop(name).nbytes
+
+    def clear(self):
+        self._storage.clear()
+
+
+_local = threading.local()
+
+
+def get_buffer_pool():
+    """Return this thread's pool (gunicorn threads must not share buffers)"""
+    pool = getattr(_local, 'pool', None)
+    if pool is None or pool.enabled != ENABLED:
+        pool = BufferPool(enabled=ENABLED)
+        _local.pool = pool
+    return pool
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+CPU-topology-aware OpenCV threading for the photo-to-coloring API
+Every process that runs the sketch pipelines gets an equal share of the
+CPUs actually available to the container (affinity and cgroup quota), so
+OpenCV's thread pools in different gunicorn workers stop competing.
+
+Calibrate the workers-vs-threads split for this machine with:
+    python cpu_tuning.py calibrate            # print the recommendation
+    python cpu_tuning.py calibrate --apply    # also write tuning.json
+gunicorn.conf.py picks up tuning.json on the next start.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+TUNING_FILE = os.path.join(APP_DIR, 'tuning.json')
+
+
+def _read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_cpu_limit():
+    """CPU limit from the cgroup quota, or None when unlimited/unknown"""
+    # cgroup v2: "<quota> <period>" or "max <period>", in our own cgroup if visible
+    relative = ''
+    try:
+        with open('/proc/self/cgroup') as f:
+            for line in f:
+                if line.startswith('0::'):
+                    relative = line.strip()[3:].lstrip('/')
+    except OSError:
+        pass
+    for path in (os.path.join('/sys/fs/cgroup', relative, 'cpu.max'), '/sys/fs/cgroup/cpu.max'):
+        value = _read_first_line(path)
+        if value:
+            quota, _, period = value.partition(' ')
+            if quota == 'max':
+                return None
+            return int(quota) / int(period or 100000)
+
+    # cgroup v1
+    quota = _read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = _read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def available_cpus():
+    """CPUs this process may use, honouring affinity and cgroup quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit:
+        cpus = min(cpus, math.ceil(limit))
+    return max(1, cpus)
+
+
+def opencv_threads_for(processes, cpus=None):
+    """OpenCV threads per process so that all processes together fill the CPUs"""
+    cpus = cpus or available_cpus()
+    return max(1, cpus // max(1, processes))
+
+
+def load_tuning():
+    """Settings saved by `calibrate --apply`, or None"""
+    try:
+        with open(TUNING_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def configure_opencv_threads(processes=None):
+    """
+    Size OpenCV's thread pool for this process
+    OPENCV_THREADS overrides the automatic value; 0 leaves OpenCV's own
+    default untouched. Otherwise the available CPUs are split evenly between
+    `processes` compute processes, which defaults to WEB_CONCURRENCY.
+    Returns the thread count set, or None when OpenCV was left alone.
+    """
+    import cv2
+
+    override = os.environ.get('OPENCV_THREADS', '').strip()
+    if override == '0':
+        # cv2.setNumThreads(0) would turn threading off, not restore the default
+        logger.info(f"OpenCV keeping its default of {cv2.getNumThreads()} threads")
+        return None
+    if override and override != 'auto':
+        threads = int(override)
+    else:
+        if processes is None:
+            processes = int(os.environ.get('WEB_CONCURRENCY') or 1)
+        threads = opencv_threads_for(processes)
+    cv2.setNumThreads(threads)
+    logger.info(f"OpenCV using {cv2.getNumThreads()} threads "
+                f"({available_cpus()} CPUs available)")
+    return threads
+
+
+# ---------------------------------------------------------------------------
+# Calibration
+# ---------------------------------------------------------------------------
+
+def _benchmark_process(threads, image_size, duration, ready, start, results):
+    """Render a style mix in a loop for `duration` seconds once started"""
+    import cv2
+    import numpy as np
+
+    logging.disable(logging.WARNING)
+    # Importing app runs configure_opencv_threads(), which reads this
+    os.environ['OPENCV_THREADS'] = str(threads)
+    from app import STYLE_STAGES, create_outline_sketch
+
+    rng = np.random.default_rng(os.getpid())
+    image = rng.integers(0, 256, (image_size, image_size, 3), dtype=np.uint8)
+    image = cv2.GaussianBlur(image, (9, 9), 0)
+    for style in STYLE_STAGES:
+        create_outline_sketch(image, style)  # warm up
+    ready.put(True)
+    start.wait()
+
+    renders = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        create_outline_sketch(image, STYLE_STAGES[renders % len(STYLE_STAGES)])
+        renders += 1
+    results.put(renders)
+
+
+def benchmark_split(workers, threads, image_size=1024, duration=10.0):
+    """Sketches per second with `workers` processes of `threads` threads"""
+    from multiprocessing import get_context
+
+    context = get_context('spawn')
+    ready, results, start = context.Queue(), context.Queue(), context.Event()
+    processes = [context.Process(target=_benchmark_process,
+                                 args=(threads, image_size, duration, ready, start, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for _ in processes:
+            ready.get()
+        start.set()
+        total = sum(results.get() for _ in processes)
+    finally:
+        for process in processes:
+            process.join()
+    return total / duration
+
+
+def candidate_splits(cpus):
+    """Worker counts from 1 to cpus (powers of two plus cpus itself)"""
+    workers = {cpus}
+    count = 1
+    while count < cpus:
+        workers.add(count)
+        count *= 2
+    return [(w, opencv_threads_for(w, cpus)) for w in sorted(workers)]
+
+
+def calibrate(image_size=1024, duration=10.0):
+    cpus = available_cpus()
+    print(f"{cpus} CPUs available; {image_size}px images, {duration:.0f}s per split")
+    print(f"{'workers':>7} {'cv threads':>10} {'sketches/s':>11}")
+    rows = []
+    for workers, threads in candidate_splits(cpus):
+        throughput = benchmark_split(workers, threads, image_size, duration)
+        rows.append({'workers': workers, 'opencv_threads': threads,
+                     'throughput': throughput})
+        print(f"{workers:>7} {threads:>10} {throughput:>11.2f}")
+    best = max(rows, key=lambda row: row['throughput'])
+    # Prefer more workers on ties: better latency isolation between requests
+    best = max((row for row in rows if row['throughput'] >= best['throughput'] * 0.97),
+               key=lambda row: row['workers'])
+    return dict(best, cpus=cpus, measurements=rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('show', help='print detected CPUs and the default split')
+    calibrate_parser = subparsers.add_parser('calibrate', help='benchmark workers vs threads')
+    calibrate_parser.add_argument('--duration', type=float, default=10.0, help='seconds per split')
+    calibrate_parser.add_argument('--image-size', type=int, default=1024)
+    calibrate_parser.add_argument('--apply', action='store_true', help=f'write {TUNING_FILE}')
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        workers = int(os.environ.get('WEB_CONCURRENCY') or 2)
+        print(f"CPUs available: {available_cpus()}")
+        print(f"OpenCV threads for {workers} workers: {opencv_threads_for(workers)}")
+        tuning = load_tuning()
+        if tuning:
+            print(f"Calibrated: {tuning['workers']} workers x {tuning['opencv_threads']} threads")
+        return
+
+    result = calibrate(args.image_size, args.duration)
+    print(f"Recommended: {result['workers']} workers x {result['opencv_threads']} OpenCV threads")
+    if args.apply:
+        with open(TUNING_FILE, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved to {TUNING_FILE}; restart gunicorn to apply")
+
+
+if __name__ == '__main__':
+    main()
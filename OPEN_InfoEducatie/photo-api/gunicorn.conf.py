@@ -0,0 +1,28 @@
+"""
+Gunicorn settings for the photo-to-coloring API
+Worker count comes from WORKERS, else from tuning.json written by
+`python cpu_tuning.py calibrate --apply`, else 2. Each worker then sizes
+OpenCV's thread pool from its share of the available CPUs, counting every
+gunicorn thread as a separate pipeline.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cpu_tuning import load_tuning
+
+tuning = load_tuning() or {}
+
+bind = os.environ.get('BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('WORKERS') or tuning.get('workers') or 2)
+threads = int(os.environ.get('THREADS') or 1)
+timeout = int(os.environ.get('TIMEOUT') or 120)
+
+# Read by app.py to size OpenCV's thread pool in every worker
+os.environ['WEB_CONCURRENCY'] = str(workers)
+os.environ['THREADS'] = str(threads)
+# Calibration measures single-threaded workers only
+if 'opencv_threads' in tuning and not os.environ.get('WORKERS') and threads == 1:
+    os.environ.setdefault('OPENCV_THREADS', str(tuning['opencv_threads']))
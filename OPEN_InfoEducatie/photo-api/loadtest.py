@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Local load-testing harness for the photo-to-coloring API
+Starts the app under gunicorn for every combination of workers, threads
+and OpenCV thread count, drives /convert and /download with a mix of
+styles and image sizes, and reports throughput, latency percentiles,
+error rate and peak RSS per configuration. Runs entirely on localhost.
+
+Example:
+    python loadtest.py --workers 1,2,4 --threads 1,2 --cv-threads 1,2 \
+        --requests 80 --concurrency 8 --json results.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SIZES = '640x480,1280x960,3000x2000,4000x3000'
+DEFAULT_STYLE_MIX = 'outline:0.5,detailed:0.3,artistic:0.2'
+
+
+def parse_int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def parse_sizes(value):
+    sizes = []
+    for item in value.split(','):
+        width, height = item.lower().split('x')
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def parse_style_mix(value):
+    styles, weights = [], []
+    for item in value.split(','):
+        name, _, weight = item.partition(':')
+        styles.append(name)
+        weights.append(float(weight or 1))
+    return styles, weights
+
+
+def make_test_image(width, height, rng):
+    """Build a photo-like JPEG: soft gradients, a face-sized blob and noise"""
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = 90 + 80 * np.sin(xs / width * 3.0) * np.cos(ys / height * 2.0)
+    image = np.dstack([base, base * 0.9 + 20, base * 0.8 + 30])
+    center = (width // 2, height // 2)
+    axes = (width // 6, height // 4)
+    cv2.ellipse(image, center, axes, 0, 0, 360, (150, 170, 200), -1)
+    for _ in range(40):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        radius = int(rng.integers(5, max(6, min(width, height) // 15)))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.circle(image, (x, y), radius, color, -1)
+    image += rng.normal(0, 12, image.shape).astype(np.float32)
+    image = cv2.GaussianBlur(np.clip(image, 0, 255).astype(np.uint8), (5, 5), 0)
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    if not ok:
+        raise RuntimeError(f"Could not encode {width}x{height} test image")
+    return encoded.tobytes()
+
+
+def encode_multipart(image_bytes, style):
+    """Encode the /convert form body without third-party HTTP clients"""
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        b'Content-Disposition: form-data; name="style"\r\n\r\n',
+        style.encode(), b'\r\n',
+        f'--{boundary}\r\n'.encode(),
+        b'Content-Disposition: form-data; name="image"; filename="photo.jpg"\r\n',
+        b'Content-Type: image/jpeg\r\n\r\n',
+        image_bytes, b'\r\n',
+        f'--{boundary}--\r\n'.encode(),
+    ])
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def process_tree_rss(pid):
+    """Resident set size in bytes of a process and all its descendants"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for tid in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{tid}/children') as children:
+                    pending.extend(int(child) for child in children.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+class RssSampler(threading.Thread):
+    """Background sampler tracking peak RSS of the server process tree"""
+
+    def __init__(self, pid, interval=0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Server:
+    """A gunicorn instance serving wsgi:app with one configuration"""
+
+    def __init__(self, port, workers, threads, cv_threads, timeout, extra_env=None):
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.cv_threads = cv_threads
+        self.timeout = timeout
+        self.extra_env = extra_env or {}
+        self.process = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self, startup_timeout=120):
+        # gunicorn also reads gunicorn.conf.py from APP_DIR; keep it in agreement
+        env = dict(os.environ, WORKERS=str(self.workers), THREADS=str(self.threads),
+                   TIMEOUT=str(self.timeout), OPENCV_THREADS=str(self.cv_threads),
+                   **self.extra_env)
+        # Same allocator setting as start.sh, so peak RSS is comparable
+        env.setdefault('MALLOC_MMAP_THRESHOLD_', '131072')
+        command = [
+            sys.executable, '-m', 'gunicorn',
+            '--bind', f'127.0.0.1:{self.port}',
+            '--workers', str(self.workers),
+            '--threads', str(self.threads),
+            '--timeout', str(self.timeout),
+            '--log-level', 'warning',
+            'wsgi:app',
+        ]
+        self.process = subprocess.Popen(command, cwd=APP_DIR, env=env,
+                                        stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with code {self.process.returncode}")
+            try:
+                with urllib.request.urlopen(f'{self.base_url}/health', timeout=2):
+                    return
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.25)
+        self.stop()
+        raise RuntimeError("gunicorn did not become healthy in time")
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def run_request(base_url, image_bytes, style, timeout):
+    """One user interaction: convert, then download the result"""
+    result = {'style': style, 'ok': False, 'convert': None, 'download': None}
+    body, content_type = encode_multipart(image_bytes, style)
+    started = time.perf_counter()
+    try:
+        convert = urllib.request.Request(f'{base_url}/convert', data=body,
+                                         headers={'Content-Type': content_type})
+        with urllib.request.urlopen(convert, timeout=timeout) as response:
+            payload = json.loads(response.read())
+        result['convert'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        with urllib.request.urlopen(f"{base_url}{payload['download_url']}",
+                                    timeout=timeout) as response:
+            response.read()
+        result['download'] = time.perf_counter() - started
+        result['ok'] = True
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def percentiles(values):
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+
+def run_config(server, warmup, workload, concurrency, timeout):
+    """Drive one running server and summarise the results"""
+    for image_bytes, style in warmup:
+        run_request(server.base_url, image_bytes, style, timeout)
+
+    sampler = RssSampler(server.process.pid)
+    sampler.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(
+            lambda item: run_request(server.base_url, item[0], item[1], timeout),
+            workload))
+    elapsed = time.perf_counter() - started
+    sampler.stop()
+
+    succeeded = [r for r in results if r['ok']]
+    return {
+        'workers': server.workers,
+        'threads': server.threads,
+        'cv_threads': server.cv_threads,
+        'requests': len(results),
+        'errors': len(results) - len(succeeded),
+        'error_rate': (len(results) - len(succeeded)) / max(len(results), 1),
+        'throughput_rps': len(succeeded) / elapsed if elapsed else 0.0,
+        'convert_latency': percentiles([r['convert'] for r in succeeded]),
+        'download_latency': percentiles([r['download'] for r in succeeded]),
+        'peak_rss_bytes': sampler.peak,
+        'sample_errors': sorted({r['error'] for r in results if not r['ok']})[:5],
+    }
+
+
+def format_ms(seconds):
+    return '-' if seconds is None else f'{seconds * 1000:.0f}'
+
+
+def print_report(rows):
+    header = (f"{'workers':>7} {'threads':>7} {'cv':>3} {'rps':>7} "
+              f"{'p50ms':>7} {'p95ms':>7} {'p99ms':>7} {'dl_p95':>7} "
+              f"{'err%':>6} {'rssMB':>7}")
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        if 'failed' in row:
+            print(f"{row['workers']:>7} {row['threads']:>7} {row['cv_threads']:>3} "
+                  f"failed: {row['failed']}")
+            continue
+        latency = row['convert_latency']
+        print(f"{row['workers']:>7} {row['threads']:>7} {row['cv_threads']:>3} "
+              f"{row['throughput_rps']:>7.2f} {format_ms(latency['p50']):>7} "
+              f"{format_ms(latency['p95']):>7} {format_ms(latency['p99']):>7} "
+              f"{format_ms(row['download_latency']['p95']):>7} "
+              f"{row['error_rate'] * 100:>6.1f} {row['peak_rss_bytes'] / 2**20:>7.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated gunicorn worker counts')
+    parser.add_argument('--threads', default='1,2', help='comma-separated gunicorn thread counts')
+    parser.add_argument('--cv-threads', default='1,2',
+                        help='comma-separated cv2.setNumThreads values (0 = OpenCV default)')
+    parser.add_argument('--requests', type=int, default=60, help='measured requests per configuration')
+    parser.add_argument('--warmup', type=int, default=4, help='unmeasured requests per configuration')
+    parser.add_argument('--concurrency', type=int, default=4, help='simultaneous clients')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma-separated WxH upload sizes')
+    parser.add_argument('--styles', default=DEFAULT_STYLE_MIX, help='style:weight mix')
+    parser.add_argument('--timeout', type=int, default=120, help='gunicorn and client timeout (s)')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--json', help='write the full results to this file')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    images = [make_test_image(w, h, rng) for w, h in parse_sizes(args.sizes)]
+    styles, weights = parse_style_mix(args.styles)
+    picker = random.Random(args.seed)
+    workload = [(picker.choice(images), picker.choices(styles, weights)[0])
+                for _ in range(args.requests)]
+    warmup = [(picker.choice(images), picker.choice(styles)) for _ in range(args.warmup)]
+
+    rows = []
+    matrix = itertools.product(parse_int_list(args.workers),
+                               parse_int_list(args.threads),
+                               parse_int_list(args.cv_threads))
+    for workers, threads, cv_threads in matrix:
+        print(f"Running workers={workers} threads={threads} cv_threads={cv_threads}...",
+              file=sys.stderr)
+        server = Server(args.port, workers, threads, cv_threads, args.timeout)
+        try:
+            server.start()
+            rows.append(run_config(server, warmup, workload, args.concurrency,
+                                   args.timeout))
+        except RuntimeError as e:
+            rows.append({'workers': workers, 'threads': threads,
+                         'cv_threads': cv_threads, 'failed': str(e)})
+        finally:
+            server.stop()
+
+    print_report(rows)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(rows, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
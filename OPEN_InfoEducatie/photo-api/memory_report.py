@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Peak memory per sketch style, optionally against an older revision
+The peak of a render is what its thread's buffer pool already held plus
+everything allocated while it ran, so pooled buffers count either way.
+"Idle" is what the pool keeps after the render (SKETCH_BUFFER_POOL_IDLE_MB).
+numpy and OpenCV outputs are both allocated through numpy, so
+tracemalloc sees them.
+
+--baseline runs the same measurement on that git revision of this
+directory, e.g. the commit before the buffer pool was introduced.
+
+Example:
+    python memory_report.py --image photo.jpg --max-size 1024 --baseline <rev>
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import tracemalloc
+
+import cv2
+import numpy as np
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STYLES = ['outline', 'detailed', 'artistic']
+
+
+def peak_bytes(func, *args):
+    """Peak traced allocation while running func(*args)"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def held_bytes():
+    """Bytes this thread's buffer pool holds (0 before the pool existed)"""
+    try:
+        import buffer_pool
+    except ImportError:
+        return 0
+    return buffer_pool.get_buffer_pool().nbytes
+
+
+def measure(image):
+    """{name: (peak bytes, bytes held once idle)} for every pipeline"""
+    from app import create_outline_sketch, fallback_edge_detection
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    runs = [(style, create_outline_sketch, (image, style)) for style in STYLES]
+    runs.append(('fallback', fallback_edge_detection, (gray,)))
+    results = {}
+    for name, func, args in runs:
+        func(*args)  # warm the pool (and OpenCV's own caches)
+        held = held_bytes()
+        peak = held + peak_bytes(func, *args)
+        results[name] = (peak, held_bytes())
+    return results
+
+
+def measure_revision(rev, args):
+    """Run this script's measurement against `rev` in a subprocess"""
+    def git(*command, cwd=APP_DIR):
+        return subprocess.run(['git', *command], cwd=cwd, check=True,
+                              capture_output=True, text=True).stdout.strip()
+
+    # git archive refuses a tree path when run from inside the work tree's subdirectory
+    toplevel = git('rev-parse', '--show-toplevel')
+    tree = f"{rev}:{git('rev-parse', '--show-prefix')}"
+    archive = subprocess.run(['git', 'archive', '--format=tar', tree], cwd=toplevel,
+                             check=True, capture_output=True).stdout
+    with tempfile.TemporaryDirectory() as app_dir:
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            tar.extractall(app_dir)
+        command = [sys.executable, os.path.abspath(__file__), '--app-dir', app_dir,
+                   '--max-size', str(args.max_size), '--json']
+        if args.image:
+            command += ['--image', os.path.abspath(args.image)]
+        output = subprocess.run(command, cwd=app_dir, check=True,
+                                capture_output=True, text=True).stdout
+    return {name: tuple(value) for name, value in json.loads(output).items()}
+
+
+def load_image(args, parser):
+    if args.image:
+        image = cv2.imread(args.image)
+        if image is None:
+            parser.error(f"could not read {args.image}")
+    else:
+        rng = np.random.default_rng(0)
+        image = rng.integers(0, 256, (args.max_size, args.max_size, 3), dtype=np.uint8)
+        image = cv2.GaussianBlur(image, (9, 9), 0)
+    from app import resize_image
+    return resize_image(image, max_size=args.max_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--image', help='photo to measure (default: synthetic)')
+    parser.add_argument('--max-size', type=int, default=1024)
+    parser.add_argument('--baseline', metavar='REV', help='git revision to compare against')
+    parser.add_argument('--app-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--json', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    if args.app_dir:
+        sys.path.insert(0, args.app_dir)
+
+    image = load_image(args, parser)
+    current = measure(image)
+    if args.json:
+        print(json.dumps(current))
+        return
+    baseline = measure_revision(args.baseline, args) if args.baseline else {}
+
+    frame = image.shape[0] * image.shape[1]
+    mib = 2**20
+    print(f"Frame {image.shape[1]}x{image.shape[0]} ({frame / mib:.2f} MiB per gray plane)")
+    print(f"{'style':<10} {'baseline MiB':>13} {'peak MiB':>9} {'idle MiB':>9} {'frames':>14}")
+    for name, (peak, idle) in current.items():
+        before = baseline.get(name, (None,))[0]
+        before_mib = '-' if before is None else f'{before / mib:.2f}'
+        before_frames = '' if before is None else f'{before / frame:.1f} -> '
+        print(f"{name:<10} {before_mib:>13} {peak / mib:>9.2f} {idle / mib:>9.2f} "
+              f"{before_frames + f'{peak / frame:.1f}':>14}")
+
+
+if __name__ == '__main__':
+    main()
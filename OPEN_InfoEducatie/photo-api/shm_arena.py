@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Shared-memory transport between the HTTP front-end and sketch workers
+Images and sketches travel as small handles pointing into reusable
+shared-memory segments instead of being pickled across processes
+"""
+
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import weakref
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Segments are rounded up to a power of two so similar frame sizes share them
+MIN_SEGMENT_SIZE = 64 * 1024
+# Idle segments kept per size class before they are unlinked
+MAX_IDLE_PER_CLASS = 4
+# Segments a worker keeps mapped between requests
+WORKER_ATTACH_CACHE = 16
+
+# What actually crosses the process boundary: a few strings and ints
+BufferHandle = namedtuple('BufferHandle', ['name', 'shape', 'dtype'])
+
+
+def _size_class(nbytes):
+    """Round a byte count up to the segment size that will hold it"""
+    size = MIN_SEGMENT_SIZE
+    while size < nbytes:
+        size *= 2
+    return size
+
+
+class SharedBuffer:
+    """A leased segment plus an ndarray view of the requested shape"""
+
+    def __init__(self, segment, shape, dtype):
+        self.segment = segment
+        self.handle = BufferHandle(segment.name, tuple(shape), np.dtype(dtype).str)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+
+
+class SharedBufferArena:
+    """
+    Pool of shared-memory segments owned by the front-end process
+    Only the owner creates and unlinks segments; workers merely attach.
+    If a worker dies mid-request the owner still holds the lease and
+    releases it as usual, and any segments left at exit are unlinked.
+    """
+
+    def __init__(self, max_idle_per_class=MAX_IDLE_PER_CLASS):
+        self.max_idle_per_class = max_idle_per_class
+        self._lock = threading.Lock()
+        self._idle = {}      # size class -> [SharedMemory]
+        self._leased = {}    # segment name -> SharedMemory
+        self._finalizer = weakref.finalize(self, SharedBufferArena._unlink_all,
+                                           self._idle, self._leased)
+        atexit.register(self.close)
+
+    def acquire(self, shape, dtype=np.uint8):
+        """Lease a buffer big enough for an array of the given shape"""
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        size = _size_class(nbytes)
+        with self._lock:
+            free = self._idle.get(size)
+            segment = free.pop() if free else None
+        if segment is None:
+            segment = SharedMemory(create=True, size=size)
+        with self._lock:
+            self._leased[segment.name] = segment
+        return SharedBuffer(segment, shape, dtype)
+
+    def release(self, buffer):
+        """Return a leased buffer to the pool, unlinking surplus segments"""
+        segment = buffer.segment
+        # Drop our view first so the mapping can be closed if it is trimmed
+        buffer.array = None
+        with self._lock:
+            if self._leased.pop(segment.name, None) is None:
+                return
+            free = self._idle.setdefault(segment.size, [])
+            if len(free) < self.max_idle_per_class:
+                free.append(segment)
+                return
+        _unlink(segment)
+
+    def stats(self):
+        """Snapshot of leased and idle segment counts and bytes"""
+        with self._lock:
+            idle = [seg for free in self._idle.values() for seg in free]
+            return {
+                'leased': len(self._leased),
+                'idle': len(idle),
+                'idle_bytes': sum(seg.size for seg in idle),
+                'leased_bytes': sum(seg.size for seg in self._leased.values()),
+            }
+
+    def close(self):
+        """Unlink every segment, leased or idle"""
+        self._finalizer()
+
+    @staticmethod
+    def _unlink_all(idle, leased):
+        for free in idle.values():
+            for segment in free:
+                _unlink(segment)
+        idle.clear()
+        for segment in leased.values():
+            _unlink(segment)
+        leased.clear()
+
+
+def _unlink(segment):
+    try:
+        segment.close()
+    except BufferError:
+        # A view is still alive somewhere; unlinking alone frees the name
+        pass
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+
+
+# ---------------------------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------------------------
+
+_attached = OrderedDict()
+
+
+def _attach_untracked(name):
+    """
+    Attach to a segment owned by the front-end process
+    Workers are spawned by the owner and share its resource tracker, so on
+    Python < 3.13 a plain attach is safe: the tracker only unlinks what is
+    left over once every process holding it is gone. After an owner crash
+    that relies on the workers exiting too, which _exit_with_parent()
+    ensures. On 3.13+ tracking is disabled outright.
+    """
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        return SharedMemory(name=name)
+
+
+def _exit_with_parent(initializer=None):
+    """
+    Worker initializer: exit as soon as the owning process dies
+    A SIGKILLed owner (gunicorn's --timeout) would otherwise leave its
+    workers blocked on the call queue forever, and with them the resource
+    tracker that unlinks the owner's segments.
+    """
+    parent = multiprocessing.parent_process()
+    if parent is not None:
+        def watch():
+            wait([parent.sentinel])
+            os._exit(1)
+        threading.Thread(target=watch, name='parent-watch', daemon=True).start()
+    if initializer is not None:
+        initializer()
+
+
+def attach(handle):
+    """Map a handle to an ndarray view, reusing cached attachments"""
+    segment = _attached.pop(handle.name, None)
+    if segment is None:
+        segment = _attach_untracked(handle.name)
+    _attached[handle.name] = segment
+    while len(_attached) > WORKER_ATTACH_CACHE:
+        _, stale = _attached.popitem(last=False)
+        try:
+            stale.close()
+        except BufferError:
+            pass
+    return np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=segment.buf)
+
+
+# ---------------------------------------------------------------------------
+# Front-end side
+# ---------------------------------------------------------------------------
+
+class SharedMemoryWorkerPool:
+    """
+    Process pool that exchanges arrays through a SharedBufferArena
+    `target(src, dst, *args)` runs in a worker with `src` and `dst` as
+    shared-memory views and must fill `dst` in place. call() runs other
+    targets with the same contract on the same workers. A call that takes
+    longer than `timeout` seconds kills the workers and raises TimeoutError.
+    """
+
+    def __init__(self, target, num_workers, arena=None, initializer=None, timeout=None):
+        self.target = target
+        self.num_workers = num_workers
+        self.initializer = initializer
+        self.timeout = timeout
+        self.arena = arena or SharedBufferArena(max_idle_per_class=num_workers * 2)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.num_workers,
+                    mp_context=get_context('spawn'),
+                    initializer=_exit_with_parent,
+                    initargs=(self.initializer,),
+                )
+            return self._executor
+
+    def _reset_executor(self, broken, kill=False):
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        if kill:
+            # shutdown() alone leaves a busy worker running; there is no
+            # public API for this before Python 3.14's terminate_workers()
+            for process in list((broken._processes or {}).values()):
+                process.kill()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    @contextmanager
+    def run(self, src, dst_shape, dst_dtype, *args):
+        """
+        Copy `src` into shared memory, run the target in a worker and
+        yield its output as a view into shared memory. The view is only
+        valid inside the `with` block; copy it if it must outlive it.
+        """
+        with self.call(self.target, src, dst_shape, dst_dtype, *args) as (dst, _):
+            yield dst
+
+    @contextmanager
+    def call(self, target, src, dst_shape, dst_dtype, *args):
+        """
+        Like run() but with an explicit target; yields `(dst, result)`
+        where `result` is the target's (picklable) return value
+        """
+        src_buffer = self.arena.acquire(src.shape, src.dtype)
+        dst_buffer = self.arena.acquire(dst_shape, dst_dtype)
+        try:
+            np.copyto(src_buffer.array, src)
+            executor = self._get_executor()
+            try:
+                result = executor.submit(_run_target, target, src_buffer.handle,
+                                         dst_buffer.handle, args).result(self.timeout)
+            except FutureTimeoutError:
+                # Kill the hung worker before its segments go back to the arena
+                logger.error(f"Sketch worker exceeded {self.timeout}s, restarting pool")
+                self._reset_executor(executor, kill=True)
+                raise TimeoutError(f"Sketch worker exceeded {self.timeout}s")
+            except BrokenProcessPool:
+                # A worker crashed; its segments are still ours to reuse
+                logger.error("Sketch worker process died, restarting pool")
+                self._reset_executor(executor)
+                raise
+            yield dst_buffer.array, result
+        finally:
+            self.arena.release(src_buffer)
+            self.arena.release(dst_buffer)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        self.arena.close()
+
+
+def _run_target(target, src_handle, dst_handle, args):
+    return target(attach(src_handle), attach(dst_handle), *args)
@@ -1,8 +1,19 @@
 #!/bin/bash
 # Start script for the photo-to-coloring API
+# Settings live in gunicorn.conf.py; override via environment, e.g.
+#   WORKERS=4 THREADS=2 OPENCV_THREADS=1 ./start.sh
+# Measure with loadtest.py, or run `python cpu_tuning.py calibrate --apply`
+# to pick workers and OpenCV threads for this machine.
 
 # Activate virtual environment
 source venv/bin/activate
 
+# Hand freed frames back to the OS: glibc otherwise raises its mmap threshold
+# after the first large free and keeps later frames on the heap for good
+export MALLOC_MMAP_THRESHOLD_="${MALLOC_MMAP_THRESHOLD_:-131072}"
+
+# Uncomment when nginx serves sketch files (see nginx-coloring.conf)
+# export X_ACCEL_REDIRECT_PREFIX=/_sketches/
+
 # Start the application with gunicorn
-gunicorn --bind 127.0.0.1:5000 --workers 2 --timeout 120 wsgi:app
\ No newline at end of file
+gunicorn -c gunicorn.conf.py wsgi:app